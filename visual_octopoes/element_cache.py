@@ -0,0 +1,97 @@
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import time
+from collections.abc import Callable
+from typing import IO
+
+import msgpack
+from pydantic import JsonValue
+
+DIGEST_SIZE = 16
+SWEEP_INTERVAL = 60
+
+
+class ElementCache:
+    def __init__(self, directory: str, ttl: float):
+        self.directory = directory
+        self.ttl = ttl
+        self.swept = 0.0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.stat(directory)
+        if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+            raise PermissionError(f"cache directory {directory} is not private to this user")
+
+    def _read(self, path: str, digest: str | None) -> tuple[list[dict] | None, str] | None:
+        try:
+            if time.time() - os.path.getmtime(path) >= self.ttl:
+                return None
+            with open(path, "rb") as fp:
+                current = fp.read(DIGEST_SIZE).hex()
+                if current == digest:
+                    return None, current
+                return msgpack.unpackb(fp.read()), current
+        except FileNotFoundError:
+            return None
+
+    def _flock(self, lock: IO, path: str, operation: int) -> bool:
+        fcntl.flock(lock, operation)
+        try:
+            return os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _sweep(self) -> None:
+        now = time.time()
+        if now - self.swept < SWEEP_INTERVAL:
+            return
+        self.swept = now
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime >= now - self.ttl - SWEEP_INTERVAL:
+                    continue
+                if not entry.name.endswith(".lock"):
+                    os.remove(entry.path)
+                    continue
+                with open(entry.path, "a") as lock:
+                    if not self._flock(lock, entry.path, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                        continue
+                    if not os.path.exists(entry.path.removesuffix(".lock")):
+                        os.remove(entry.path)
+            except (FileNotFoundError, BlockingIOError):
+                pass
+
+    def get(
+        self,
+        key: JsonValue,
+        digest: str | None,
+        build: Callable[[], list[dict]],
+    ) -> tuple[list[dict] | None, str]:
+        name = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        path = os.path.join(self.directory, name)
+        while True:
+            with open(f"{path}.lock", "a") as lock:
+                if not self._flock(lock, f"{path}.lock", fcntl.LOCK_SH):
+                    continue
+                entry = self._read(path, digest)
+                if entry is None:
+                    if not self._flock(lock, f"{path}.lock", fcntl.LOCK_EX):
+                        continue
+                    entry = self._read(path, digest)
+                if entry is not None:
+                    return entry
+                os.utime(lock.fileno())
+                elements = build()
+                data = msgpack.packb(elements)
+                current = hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+                with open(f"{path}.{os.getpid()}", "wb") as fp:
+                    fp.write(current)
+                    fp.write(data)
+                os.replace(f"{path}.{os.getpid()}", path)
+                break
+        self._sweep()
+        if current.hex() == digest:
+            return None, digest
+        return elements, current.hex()
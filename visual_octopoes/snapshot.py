@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import contextlib
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Iterator
+from datetime import datetime, timezone
+from itertools import chain
+
+import msgpack
+from pydantic import JsonValue
+from xtdb_client import XTDBClient
+
+SNAPSHOT_MAGIC = b"VOSNAP01"
+SNAPSHOT_TRAILER = struct.Struct(f"<Q{len(SNAPSHOT_MAGIC)}s")
+
+SNAPSHOT_QUERIES = {
+    "oois": "{:query {:find [(pull ?var [*])] :where [[?var :object_type]]}}",
+    "origins": '{:query {:find [(pull ?var [*])] :where [[?var :type "Origin"]]}}',
+    "origin_parameters": '{:query {:find [(pull ?var [*])] :where [[?var :type "OriginParameter"]]}}',
+    "scan_profiles": '{:query {:find [(pull ?var [*])] :where [[?var :type "ScanProfile"]]}}',
+}
+
+
+def export_snapshot(
+    client: XTDBClient,
+    path: str,
+    valid_time: datetime | None = None,
+) -> None:
+    valid_time = valid_time or datetime.now(timezone.utc)
+    status = client.status()
+    if isinstance(status, dict) and "error" in status:
+        raise ConnectionError(f"cannot export snapshot: {status['error']}")
+    tx = client.latest_completed_tx()
+    if isinstance(tx, dict) and "error" in tx:
+        raise ConnectionError(f"cannot export snapshot: {tx['error']}")
+    tx_id = tx["txId"] if tx else None
+    tables: dict[str, list[tuple[int, int]]] = {}
+    ids: dict[str, tuple[int, int]] = {}
+    try:
+        with open(f"{path}.{os.getpid()}", "wb") as fp:
+            fp.write(SNAPSHOT_MAGIC)
+            offset = len(SNAPSHOT_MAGIC)
+            for table, query in SNAPSHOT_QUERIES.items():
+                result = client.query(query, valid_time=valid_time, tx_id=tx_id)
+                if isinstance(result, dict) and "error" in result:
+                    raise ConnectionError(f"cannot export {table}: {result['error']}")
+                tables[table] = []
+                for record in chain.from_iterable(result):
+                    data = msgpack.packb(record)
+                    fp.write(data)
+                    tables[table].append((offset, len(data)))
+                    ids[record["xt/id"]] = (offset, len(data))
+                    offset += len(data)
+            fp.write(
+                msgpack.packb(
+                    {
+                        "meta": {
+                            "status": status,
+                            "valid_time": valid_time.isoformat(),
+                            "exported_at": datetime.now(timezone.utc).isoformat(),
+                            "latest_completed_tx": tx,
+                        },
+                        "tables": tables,
+                        "ids": ids,
+                    }
+                )
+            )
+            fp.write(SNAPSHOT_TRAILER.pack(offset, SNAPSHOT_MAGIC))
+        os.replace(f"{path}.{os.getpid()}", path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(f"{path}.{os.getpid()}")
+        raise
+
+
+class SnapshotClient:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as fp:
+            self._buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._buffer)
+        end = len(self._buffer) - SNAPSHOT_TRAILER.size
+        if end < len(SNAPSHOT_MAGIC) or self._buffer[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a Visual Octopoes snapshot")
+        index_offset, magic = SNAPSHOT_TRAILER.unpack_from(self._buffer, end)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is a truncated Visual Octopoes snapshot")
+        index = msgpack.unpackb(self._view[index_offset:end])
+        self._meta: dict = index["meta"]
+        self._tables: dict[str, list[list[int]]] = index["tables"]
+        self._ids: dict[str, list[int]] = index["ids"]
+        self._queries = {query: table for table, query in SNAPSHOT_QUERIES.items()}
+
+    def _record(self, span: list[int]) -> dict:
+        offset, length = span
+        return msgpack.unpackb(self._view[offset : offset + length])
+
+    def _history_entry(self, key: str, with_docs: bool = True) -> dict:
+        tx = self._meta["latest_completed_tx"] or {}
+        entry = {
+            "xtdb.api/tx-time": tx.get("txTime"),
+            "xtdb.api/tx-id": tx.get("txId"),
+            "xtdb.api/valid-time": self._meta["valid_time"],
+        }
+        if with_docs:
+            entry["xtdb.api/doc"] = self._record(self._ids[key])
+        return entry
+
+    def status(self) -> JsonValue:
+        return self._meta["status"] | {
+            "snapshot": self.path,
+            "snapshot-valid-time": self._meta["valid_time"],
+            "snapshot-exported-at": self._meta["exported_at"],
+        }
+
+    def query(
+        self,
+        query: str = SNAPSHOT_QUERIES["oois"],
+        valid_time: datetime | None = None,
+        tx_time: datetime | None = None,
+        tx_id: int | None = None,
+    ) -> Iterator[list[dict]] | JsonValue:
+        if query not in self._queries:
+            return {"error": f"query not available in snapshot {self.path}: {query}"}
+        return ([self._record(span)] for span in self._tables[self._queries[query]])
+
+    def entity(
+        self,
+        key: str,
+        valid_time: datetime | None = None,
+        tx_time: datetime | None = None,
+        tx_id: int | None = None,
+    ) -> JsonValue:
+        if key not in self._ids:
+            return {"error": f"{key} entity not found"}
+        return self._record(self._ids[key])
+
+    def history(self, key: str, with_corrections: bool, with_docs: bool) -> JsonValue:
+        if key not in self._ids:
+            return []
+        return [self._history_entry(key, with_docs)]
+
+    def entity_tx(
+        self,
+        key: str,
+        valid_time: datetime | None = None,
+        tx_time: datetime | None = None,
+        tx_id: int | None = None,
+    ) -> JsonValue:
+        if key not in self._ids:
+            return {"error": f"{key} entity not found"}
+        return {"xt/id": key} | self._history_entry(key, False)
+
+    def latest_completed_tx(self) -> JsonValue:
+        return self._meta["latest_completed_tx"]
+
+    def latest_submitted_tx(self) -> JsonValue:
+        return self._meta["latest_completed_tx"]
+
+    def submit_tx(self, transactions: list) -> JsonValue:
+        return {"error": f"snapshot {self.path} is read-only"}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        sys.exit(f"usage: {sys.argv[0]} NODE URL SNAPSHOT")
+    export_snapshot(XTDBClient(sys.argv[2], sys.argv[1], 7200), sys.argv[3])
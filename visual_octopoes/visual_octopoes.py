@@ -2,54 +2,115 @@
 
 import hashlib
 import json
+import os
 import sys
+import tempfile
+import threading
 import urllib.parse
-from copy import deepcopy
+from collections import OrderedDict
 from datetime import datetime, timezone
+from functools import cache
 from itertools import chain
 
 import dash_cytoscape as cyto
-from dash import Dash, dcc, html
-from dash.dependencies import Input, Output
+from dash import Dash, dcc, html, no_update
+from dash.dependencies import Input, Output, State
+from dotenv import load_dotenv
+from element_cache import ElementCache
+from snapshot import SNAPSHOT_QUERIES, SnapshotClient
 from xtdb_client import XTDBClient
 
 cyto.load_extra_layouts()
+load_dotenv()
 
 
 DEFAULT_XTDB_NODE = "0"
 DEFAULT_XTDB_URL = "http://localhost:3000"
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), f"visual_octopoes-{os.getuid()}")
+DEFAULT_CACHE_TTL = "1"
+MAX_SESSIONS = 16
+SNAPSHOT_DIR = (
+    os.path.realpath(os.environ["VISUAL_OCTOPOES_SNAPSHOT_DIR"])
+    if os.getenv("VISUAL_OCTOPOES_SNAPSHOT_DIR")
+    else None
+)
+
+XTDB_NODE = (
+    sys.argv[1]
+    if __name__ == "__main__" and len(sys.argv) > 1
+    else os.getenv("XTDB_NODE", DEFAULT_XTDB_NODE)
+)
+XTDB_URL = (
+    sys.argv[2]
+    if __name__ == "__main__" and len(sys.argv) > 2
+    else os.getenv("XTDB_URL", DEFAULT_XTDB_URL)
+)
+
+
+PROFILE_BORDERS = {
+    "declared": "solid",
+    "inherited": "dashed",
+    "empty": "none",
+}
 
 
+@cache
 def colorize(a: str) -> str:
     seed = "137"
     h = int(hashlib.sha512((seed + a + seed).encode()).hexdigest(), 16)
     return f"#{(h & 0xFF0000) >> 16:02x}{(h & 0x00FF00) >> 8:02x}{(h & 0x0000FF):02x}"
 
 
+def error_elements(status: dict, xtdb_node: str, xtdb_url: str) -> list[dict]:
+    return [
+        {
+            "data": {
+                "id": "error",
+                "label": "Error",
+                "info": status
+                | {
+                    "node": xtdb_node,
+                    "url": xtdb_url,
+                    "default_node": DEFAULT_XTDB_NODE,
+                    "default_url": DEFAULT_XTDB_URL,
+                    "xt/id": "error",
+                },
+                "profile": "undifined",
+            },
+            "style": {"background-color": colorize("error")},
+        }
+    ]
+
+
 class XTDBSession:
     def __init__(
         windows95,
-        xtdb_node: str = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_XTDB_NODE,
-        xtdb_url: str = sys.argv[2] if len(sys.argv) > 1 else DEFAULT_XTDB_URL,
+        xtdb_node: str = XTDB_NODE,
+        xtdb_url: str = XTDB_URL,
     ):
         windows95.connect(xtdb_node, xtdb_url)
-        windows95.valid_time: datetime = datetime.now(timezone.utc)
 
     def connect(
         windows95,
         xtdb_node: str,
         xtdb_url: str,
     ) -> None:
+        client = (
+            SnapshotClient(xtdb_url.removeprefix("file://"))
+            if xtdb_url.startswith("file://")
+            else XTDBClient(
+                xtdb_url,
+                xtdb_node,
+                7200,
+            )
+        )
         windows95.node: str = xtdb_node
         windows95.url: str = xtdb_url
-        windows95.client: XTDBClient = XTDBClient(
-            xtdb_url,
-            xtdb_node,
-            7200,
-        )
+        windows95.client: XTDBClient | SnapshotClient = client
 
     def elements(
         windows95,
+        valid_time: datetime,
         add_origins: bool = True,
         add_fakes: bool = True,
         add_fake_null: bool = True,
@@ -60,111 +121,63 @@ class XTDBSession:
         except Exception as e:
             status = {"error": str(e)}
         if isinstance(status, dict) and "error" in status:
-            return [
-                {
-                    "data": {
-                        "id": "error",
-                        "label": "Error",
-                        "info": status
-                        | {
-                            "node": windows95.node,
-                            "url": windows95.url,
-                            "default_node": DEFAULT_XTDB_NODE,
-                            "default_url": DEFAULT_XTDB_URL,
-                            "xt/id": "error",
-                        },
-                        "profile": "undifined",
-                    },
-                    "style": {"background-color": colorize("error")},
-                }
-            ]
+            return error_elements(status, windows95.node, windows95.url)
         else:
             oois = list(
                 chain.from_iterable(
                     windows95.client.query(
-                        "{:query {:find [(pull ?var [*])] :where [[?var :object_type]]}}",
-                        valid_time=windows95.valid_time,
+                        SNAPSHOT_QUERIES["oois"],
+                        valid_time=valid_time,
                     )
                 )
             )
             origins = list(
                 chain.from_iterable(
                     windows95.client.query(
-                        '{:query {:find [(pull ?var [*])] :where [[?var :type "Origin"]]}}',
-                        valid_time=windows95.valid_time,
+                        SNAPSHOT_QUERIES["origins"],
+                        valid_time=valid_time,
                     )
                 )
             )
             origin_parameters = list(
                 chain.from_iterable(
                     windows95.client.query(
-                        '{:query {:find [(pull ?var [*])] :where [[?var :type "OriginParameter"]]}}',
-                        valid_time=windows95.valid_time,
+                        SNAPSHOT_QUERIES["origin_parameters"],
+                        valid_time=valid_time,
                     )
                 )
             )
             scan_profiles = list(
                 chain.from_iterable(
                     windows95.client.query(
-                        '{:query {:find [(pull ?var [*])] :where [[?var :type "ScanProfile"]]}}',
-                        valid_time=windows95.valid_time,
+                        SNAPSHOT_QUERIES["scan_profiles"],
+                        valid_time=valid_time,
                     )
                 )
             )
-            xtids = set(map(lambda ooi: ooi["xt/id"], oois))
-            fake_null = False
-            for origin in origins:
-                if not origin["result"] and add_fake_null:
-                    origin["result"].append("fake_null")
-                    fake_null = True
-            connectors = list(
-                chain.from_iterable(
-                    [
-                        zip(
-                            [origin["source"]] * len(origin["result"]),
-                            origin["result"],
-                            [origin] * len(origin["result"]),
-                            [origin["origin_type"]] * len(origin["result"]),
-                            [origin["xt/id"]] * len(origin["result"]),
-                        )
-                        for origin in origins
-                    ]
+            xtids = {ooi["xt/id"] for ooi in oois}
+            fake_null = add_fake_null and any(not origin["result"] for origin in origins)
+            connectors = [
+                (origin["source"], target, origin)
+                for origin in origins
+                for target in (
+                    origin["result"] or (["fake_null"] if add_fake_null else [])
                 )
-            )
-            if add_refs:
-                reffields = {
-                    ooi["xt/id"]: (
-                        ooi,
-                        {
-                            key: ooi[key]
-                            for key in set(ooi.keys()) - {"xt/id"}
-                            if str(ooi[key]) in xtids and ooi[key] != ooi["xt/id"]
-                        },
-                    )
+            ]
+            references = (
+                [
+                    (ooi["xt/id"], value, ooi)
                     for ooi in oois
-                }
-                references = list(
-                    chain.from_iterable(
-                        [
-                            zip(
-                                [xtid] * len(refs),
-                                refs.values(),
-                                [ooi] * len(refs),
-                            )
-                            for xtid, (ooi, refs) in reffields.items()
-                            if refs
-                        ]
-                    )
-                )
-            else:
-                references = []
+                    for key, value in ooi.items()
+                    if key != "xt/id"
+                    and str(value) in xtids
+                    and value != ooi["xt/id"]
+                ]
+                if add_refs
+                else []
+            )
             parameters = {op["origin_id"]: op for op in origin_parameters}
             profiles = {sp["reference"]: sp for sp in scan_profiles}
-            profile_borders = {
-                "declared": "solid",
-                "inherited": "dashed",
-                "empty": "none",
-            }
             fakes = (
                 [
                     {
@@ -179,17 +192,20 @@ class XTDBSession:
                         },
                         "style": {"background-color": "red"},
                     }
-                    for fake in [
-                        connector[0]
-                        for connector in connectors
-                        if connector[0] not in xtids
-                    ]
-                    + [
-                        connector[1]
-                        for connector in connectors
-                        for connector in connectors
-                        if connector[1] != "fake_null" and connector[1] not in xtids
-                    ]
+                    for fake in dict.fromkeys(
+                        chain(
+                            (
+                                source
+                                for source, _, _ in connectors
+                                if source not in xtids
+                            ),
+                            (
+                                target
+                                for _, target, _ in connectors
+                                if target != "fake_null" and target not in xtids
+                            ),
+                        )
+                    )
                 ]
                 if add_fakes
                 else []
@@ -209,25 +225,22 @@ class XTDBSession:
                         "style": {"background-color": "red"},
                     }
                 )
-            for origin in origins:
-                if "fake_null" in origin["result"]:
-                    origin["result"].remove("fake_null")
             edges = (
                 [
                     {
                         "data": {
                             "source": source,
                             "target": target,
-                            "info": info,
-                            "kind": kind,
-                            "parameter": parameters[id] if id in parameters else None,
+                            "info": origin,
+                            "kind": origin["origin_type"],
+                            "parameter": parameters.get(origin["xt/id"]),
                         },
                         "style": {
-                            "line-color": colorize(kind),
-                            "target-arrow-color": colorize(kind),
+                            "line-color": colorize(origin["origin_type"]),
+                            "target-arrow-color": colorize(origin["origin_type"]),
                         },
                     }
-                    for source, target, info, kind, id in connectors
+                    for source, target, origin in connectors
                 ]
                 if add_origins
                 else []
@@ -255,41 +268,56 @@ class XTDBSession:
                         "id": ooi["xt/id"],
                         "label": ooi["object_type"],
                         "info": ooi,
-                        "profile": (
-                            profiles[ooi["xt/id"]] if ooi["xt/id"] in profiles else None
-                        ),
+                        "profile": profile,
                     },
                     "style": {
                         "background-color": colorize(ooi["object_type"]),
                         "border-width": (
-                            f"{2 * int(profiles[ooi["xt/id"]]["level"])}px"
-                            if ooi["xt/id"] in profiles
-                            else "10px"
+                            f"{2 * int(profile["level"])}px" if profile else "10px"
                         ),
-                        "border-color": "black" if ooi["xt/id"] in profiles else "red",
+                        "border-color": "black" if profile else "red",
                         "border-style": (
-                            profile_borders[profiles[ooi["xt/id"]]["scan_profile_type"]]
-                            if ooi["xt/id"] in profiles
-                            and profiles[ooi["xt/id"]]["scan_profile_type"]
-                            in profile_borders
+                            PROFILE_BORDERS.get(profile["scan_profile_type"], "double")
+                            if profile
                             else "double"
                         ),
                     },
                 }
                 for ooi in oois
+                for profile in (profiles.get(ooi["xt/id"]),)
             ]
             return nodes + fakes + edges + dashes
 
 
+SESSIONS: OrderedDict[tuple[str, str], XTDBSession] = OrderedDict()
+SESSIONS_LOCK = threading.Lock()
+
+
+def get_session(xtdb_node: str, xtdb_url: str) -> XTDBSession:
+    if xtdb_url.startswith("file://") and xtdb_url != XTDB_URL:
+        path = os.path.realpath(xtdb_url.removeprefix("file://"))
+        if SNAPSHOT_DIR is None or os.path.commonpath([path, SNAPSHOT_DIR]) != SNAPSHOT_DIR:
+            raise PermissionError(f"snapshot {path} is not in the snapshot directory")
+    with SESSIONS_LOCK:
+        if (xtdb_node, xtdb_url) in SESSIONS:
+            SESSIONS.move_to_end((xtdb_node, xtdb_url))
+            return SESSIONS[(xtdb_node, xtdb_url)]
+        session = XTDBSession(xtdb_node, xtdb_url)
+        SESSIONS[(xtdb_node, xtdb_url)] = session
+        if len(SESSIONS) > MAX_SESSIONS:
+            SESSIONS.popitem(last=False)
+        return session
+
+
 app = Dash(__name__, title="VisualOctopoesStudio", update_title=None)
-session = XTDBSession()
+server = app.server
 base_elements = [
     {
         "data": {
             "id": "init",
             "label": "Initializing...",
             "info": {
-                "current_node": session.node,
+                "current_node": XTDB_NODE,
                 "default_node": DEFAULT_XTDB_NODE,
                 "xt/id": "init",
             },
@@ -324,6 +352,7 @@ app.layout = html.Div(
             interval=257,
         ),
         dcc.Location(id="url", refresh=False),
+        dcc.Store(id="digest"),
         cyto.Cytoscape(
             id="cytoscape",
             layout={
@@ -410,38 +439,64 @@ app.layout = html.Div(
 )
 
 
-ELEMENT_CACHE = []
+ELEMENT_CACHE = ElementCache(
+    os.getenv("VISUAL_OCTOPOES_CACHE_DIR", DEFAULT_CACHE_DIR),
+    float(os.getenv("VISUAL_OCTOPOES_CACHE_TTL", DEFAULT_CACHE_TTL)),
+)
 
 
 @app.callback(
     Output("cytoscape", "elements"),
     Output("datetime", "placeholder"),
+    Output("digest", "data"),
     Input("updater", "n_intervals"),
     Input("url", "search"),
     Input("datetime", "value"),
     Input("cytoscape", "elements"),
+    State("digest", "data"),
 )
-def update_graph(_, search, value, current_elements):
-    session.valid_time = datetime.now(timezone.utc)
+def update_graph(_, search, value, current_elements, digest):
+    valid_time = datetime.now(timezone.utc)
+    fixed_time = None
     if value:
         try:
-            new_time = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
+            valid_time = fixed_time = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S")
         except ValueError:
-            new_time = datetime.now(timezone.utc)
-        if session.valid_time != new_time:
-            session.valid_time = new_time
+            pass
     params = urllib.parse.parse_qs(search.lstrip("?"))
-    xtdb_node = params.get("node", [session.node])[0]
-    xtdb_url = params.get("url", [session.url])[0]
+    xtdb_node = params.get("node", [XTDB_NODE])[0]
+    xtdb_url = params.get("url", [XTDB_URL])[0]
+    try:
+        session = get_session(xtdb_node, xtdb_url)
+    except (OSError, ValueError) as e:
+        if digest == f"error: {e}":
+            return no_update, valid_time, no_update
+        return (
+            error_elements({"error": str(e)}, xtdb_node, xtdb_url),
+            valid_time,
+            f"error: {e}",
+        )
     add_origin = False if params.get("noorigins", "0")[0] == "1" else True
     add_fakes = False if params.get("nofakes", "0")[0] == "1" else True
     add_fake_null = False if params.get("nonull", "0")[0] == "1" else True
     add_refs = False if params.get("norefs", "0")[0] == "1" else True
-    if session.node != xtdb_node:
-        session.connect(xtdb_node, xtdb_url)
-    if session.url != xtdb_url:
-        session.connect(xtdb_node, xtdb_url)
-    new_elements = session.elements(add_origin, add_fakes, add_fake_null, add_refs)
+    new_elements, new_digest = ELEMENT_CACHE.get(
+        [
+            session.node,
+            session.url,
+            fixed_time.isoformat() if fixed_time else None,
+            add_origin,
+            add_fakes,
+            add_fake_null,
+            add_refs,
+        ],
+        digest if len(current_elements) > 1 else None,
+        lambda: session.elements(
+            valid_time, add_origin, add_fakes, add_fake_null, add_refs
+        ),
+    )
+    if new_elements is None:
+        return no_update, valid_time, no_update
     curdict = {
         element["data"]["info"]["xt/id"]: element for element in current_elements
     }
@@ -460,17 +515,7 @@ def update_graph(_, search, value, current_elements):
         ],
         key=lambda element: element["data"]["info"]["xt/id"],
     )
-    global ELEMENT_CACHE
-    if len(current_elements) <= 1:
-        return update_elements, session.valid_time
-    elif update_elements != ELEMENT_CACHE:
-        ELEMENT_CACHE = deepcopy(update_elements)
-        return update_elements, session.valid_time
-    else:
-        return current_elements, session.valid_time
-
-
-REGISTER = "Press a node or edge for content info"
+    return update_elements, valid_time, new_digest
 
 
 @app.callback(
@@ -480,9 +525,13 @@ REGISTER = "Press a node or edge for content info"
     Input("cytoscape", "selectedNodeData"),
     Input("cytoscape", "selectedEdgeData"),
     Input("profile", "style"),
+    State("info", "children"),
+    State("url", "search"),
 )
-def display_info(node_info, edge_info, profile_style):
-    global REGISTER
+def display_info(node_info, edge_info, profile_style, current_info, search):
+    params = urllib.parse.parse_qs(search.lstrip("?"))
+    xtdb_node = params.get("node", [XTDB_NODE])[0]
+    xtdb_url = params.get("url", [XTDB_URL])[0]
     retval1 = "Press a node or edge for content info"
     retval2 = None
     retval3 = {**profile_style, "display": "none"}
@@ -492,7 +541,8 @@ def display_info(node_info, edge_info, profile_style):
             retval3.pop("display")
         retval1 = json.dumps(node_info[0]["info"], sort_keys=True, indent=2)
         retval2 = "\n" + json.dumps(node_info[0]["profile"], sort_keys=True, indent=2)
-        if retval1 == REGISTER:
+        if retval1 == current_info:
+            session = get_session(xtdb_node, xtdb_url)
             data = session.client.history(node_info[0]["id"], True, True)
             retval1 = json.dumps(data, sort_keys=True, indent=2)
             profile = session.client.history(
@@ -508,7 +558,8 @@ def display_info(node_info, edge_info, profile_style):
             retval2 = "\n" + json.dumps(
                 edge_info[0]["parameter"], sort_keys=True, indent=2
             )
-        if retval1 == REGISTER:
+        if retval1 == current_info:
+            session = get_session(xtdb_node, xtdb_url)
             data = session.client.history(edge_info[0]["info"]["xt/id"], True, True)
             retval1 = json.dumps(data, sort_keys=True, indent=2)
             if edge_info[0]["parameter"]:
@@ -519,7 +570,6 @@ def display_info(node_info, edge_info, profile_style):
                 )
                 retval2 = "\n" + json.dumps(data, sort_keys=True, indent=2)
 
-    REGISTER = retval1
     return retval1, retval2, retval3
 
 